@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+import os
+import zlib
+import hashlib
+import time
+import struct
+import tempfile
+from zipfile import ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT, LargeZipFile
+
+# Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
+#
+# Creative Commons CC0 “No Rights Reserved”
+#  See https://creativecommons.org/share-your-work/public-domain/cc0/
+#
+# Content addressed store of deflated zip member payloads, so assets shared
+#  by many ePubs (fonts, images, CSS) are compressed once and then copied
+#  raw into every archive that uses them.
+
+# defaults safe to override when installing
+storedir = os.path.join(os.path.expanduser('~'), '.cache', 'epub-tools', 'store')
+storelimit = 512 * 1024 * 1024  # bytes kept after garbage collection
+minsize = 1024                  # smaller members are not worth a store lookup
+
+# members that are unique to a book and not worth storing
+skipnames = ['mimetype']
+skipextensions = ['.xhtml', '.opf', '.ncx']
+
+# every payload file starts with this header: magic, CRC-32 and size of the
+#  uncompressed data, then CRC-32 and size of the payload that follows
+header = struct.Struct('<4sIQIQ')
+magic = b'EPAS'
+
+# payloads being written carry this prefix until they are renamed into place
+tmpprefix = '.tmp-'
+tmpmaxage = 24 * 60 * 60        # seconds before an abandoned temp file is removed
+
+def setStoreDirectory(string):
+    global storedir
+    storedir = string
+
+def setStoreLimit(size):
+    global storelimit
+    storelimit = size
+
+def isSharedAsset(info, data):
+    if info.compress_type != ZIP_DEFLATED:
+        return False
+    if len(data) < minsize:
+        return False
+    if info.filename in skipnames:
+        return False
+    return not os.path.splitext(info.filename)[1].lower() in skipextensions
+
+# same settings zipfile uses so the raw copy is byte identical to writestr()
+def deflate(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def storePath(data):
+    key = hashlib.sha256(data).hexdigest()
+    return os.path.join(storedir, key[0:2], key)
+
+# returns the stored payload for data, or None when there is no usable one.
+#  The header is checked instead of inflating the payload, a payload that
+#  does not match is removed.
+def readPayload(path, data, crc):
+    try:
+        with open(path, 'rb') as fh:
+            stored = fh.read()
+    except OSError:
+        return None
+    payload = stored[header.size:]
+    valid = False
+    if len(stored) >= header.size:
+        mark, datacrc, datasize, payloadcrc, payloadsize = header.unpack_from(stored)
+        valid = (mark == magic and datacrc == crc and datasize == len(data)
+                 and payloadsize == len(payload) and payloadcrc == zlib.crc32(payload))
+    if not valid:
+        print ("Removing corrupt payload " + path + " from the asset store.")
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return None
+    # mtime is the last use for garbage collection
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return payload
+
+# returns the deflated payload for data, compressing and storing it on a miss.
+#  A store that can not be written to only costs the reuse, not the archive.
+def getPayload(data, crc):
+    path = storePath(data)
+    payload = readPayload(path, data, crc)
+    if payload is not None:
+        return payload
+    payload = deflate(data)
+    tmppath = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so concurrent packagers never see a partial payload
+        fd, tmppath = tempfile.mkstemp(prefix=tmpprefix, dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(header.pack(magic, crc, len(data), zlib.crc32(payload), len(payload)))
+            fh.write(payload)
+        os.replace(tmppath, path)
+    except OSError:
+        print ("Could not add payload " + path + " to the asset store.")
+        if tmppath is not None:
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+    return payload
+
+# writes data to the open ZipFile as info, using the stored payload. zipfile
+#  has no public way to add precompressed data, so the local header and
+#  payload are written directly and the member registered the way
+#  ZipFile.writestr() does it, including its defaults and checks.
+def writeMember(zipfile, info, data):
+    # unseekable output needs data descriptors, leave that to zipfile
+    if not zipfile._seekable or not isSharedAsset(info, data):
+        zipfile.writestr(info, data)
+        return
+    crc = zlib.crc32(data)
+    payload = getPayload(data, crc)
+    member = ZipInfo(info.filename, info.date_time)
+    member.compress_type = ZIP_DEFLATED
+    member.external_attr = info.external_attr
+    member.create_system = info.create_system
+    # same default ZipFile._open_to_write() gives members without attributes
+    if not member.external_attr:
+        member.external_attr = 0o600 << 16
+    member.file_size = len(data)
+    member.compress_size = len(payload)
+    member.CRC = crc
+    if zipfile._writing:
+        raise ValueError("Can't write to the ZIP file while there is another write handle open on it.")
+    zip64 = member.file_size * 1.05 > ZIP64_LIMIT
+    if zip64 and not zipfile._allowZip64:
+        raise LargeZipFile("Filesize would require ZIP64 extensions")
+    with zipfile._lock:
+        zipfile.fp.seek(zipfile.start_dir)
+        member.header_offset = zipfile.fp.tell()
+        # duplicate name warning, compression and archive zip64 limits
+        zipfile._writecheck(member)
+        zipfile._didModify = True
+        zipfile.fp.write(member.FileHeader(zip64))
+        zipfile.fp.write(payload)
+        zipfile.filelist.append(member)
+        zipfile.NameToInfo[member.filename] = member
+        zipfile.start_dir = zipfile.fp.tell()
+
+# removes least recently used payloads until the store fits storelimit
+def collectGarbage():
+    entries = []
+    total = 0
+    for path, dirs, files in os.walk(storedir):
+        for filename in files:
+            filepath = os.path.join(path, filename)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            if filename.startswith(tmpprefix):
+                # another packager may still be writing it
+                if stat.st_mtime < time.time() - tmpmaxage:
+                    try:
+                        os.unlink(filepath)
+                    except OSError:
+                        pass
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filepath))
+            total += stat.st_size
+    entries.sort()
+    removed = 0
+    for mtime, size, filepath in entries:
+        if total <= storelimit:
+            break
+        try:
+            os.unlink(filepath)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import sys
+import os
+import io
+import json
+import time
+import pathlib
+import platform
+import tempfile
+import subprocess
+import contextlib
+import argparse
+import createSkeletonEpub
+import iBooksOptions
+
+# Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
+#
+# Creative Commons CC0 “No Rights Reserved”
+#  See https://creativecommons.org/share-your-work/public-domain/cc0/
+#
+# Times the createSkeletonEpub and iBooksOptions functions at volume. Runs
+#  offline and writes per-call latency percentiles as JSON for trend tracking.
+
+langtags = ['en', 'en-US', 'en-GB', 'de-CH-1901', 'zh-Hant-TW', 'sr-Latn-RS', 'es-419', 'sl-rozaj', 'zh-yue-HK', 'de-DE-u-co-phonebk', 'az-Arab-x-AZE-derbend']
+
+# latency summary of a list of per-call timings in seconds
+def percentiles(timings):
+    timings = sorted(timings)
+    count = len(timings)
+    def pick(pct):
+        return timings[min(count - 1, int(round(pct / 100 * (count - 1))))]
+    return {'calls': count,
+            'mean': sum(timings) / count,
+            'p50': pick(50),
+            'p90': pick(90),
+            'p99': pick(99),
+            'max': timings[-1]}
+
+# calls function(i) iterations times with stdout discarded. When given,
+#  setup(i) is called before each call outside the timed region.
+def timeCalls(function, iterations, setup=None):
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(iterations):
+            if setup is not None:
+                setup(i)
+            start = time.perf_counter()
+            function(i)
+            timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+def largeTextString(size):
+    words = ['Pipfrosch', 'Press', 'ePub', 'workflow', 'paragraph', 'chapter']
+    string = ' '.join(words[i % len(words)] for i in range(size // 8))
+    return string[0:size]
+
+def entityTextString(size):
+    entities = ['&lt;', '&gt;', '&amp;', '&#x3C;', '&#x003e;', '&#38;', '<', '>', 'text ']
+    string = ''.join(entities[i % len(entities)] for i in range(size // 4))
+    return string[0:size]
+
+def benchSanitize(iterations):
+    results = {}
+    for size in [1024, 65536, 1048576]:
+        string = largeTextString(size)
+        results['large-' + str(size)] = timeCalls(lambda i: createSkeletonEpub.sanitizeTextString('bench', string), iterations)
+        string = entityTextString(size)
+        results['entity-' + str(size)] = timeCalls(lambda i: createSkeletonEpub.sanitizeTextString('bench', string), iterations)
+    return results
+
+def benchCreateOPF(iterations, workdir):
+    opf = workdir.joinpath('content.opf')
+    createSkeletonEpub.setBookPublisher('Pipfrosch Press')
+    createSkeletonEpub.setBookIdentifier('urn:uuid:00000000-0000-4000-8000-000000000000')
+    return {'createOPF': timeCalls(lambda i: createSkeletonEpub.createOPF(opf), iterations)}
+
+def benchLanguageTags(iterations):
+    results = {}
+    results['setXmlLang'] = timeCalls(lambda i: createSkeletonEpub.setXmlLang(langtags[i % len(langtags)]), iterations)
+    results['setBookLang'] = timeCalls(lambda i: createSkeletonEpub.setBookLang(langtags[i % len(langtags)]), iterations)
+    return results
+
+# display options file with platforms * options option nodes
+def optionsFileString(platforms, options):
+    names = ['fixed-layout', 'specified-fonts', 'open-to-spread', 'interactive']
+    lines = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>', '<display_options>']
+    for i in range(platforms):
+        lines.append('  <platform name="platform' + str(i) + '">')
+        for j in range(options):
+            lines.append('    <option name="' + names[j % len(names)] + '">true</option>')
+        lines.append('  </platform>')
+    lines.append('</display_options>')
+    return '\n'.join(lines)
+
+def benchModifyMetaFile(iterations, workdir):
+    results = {}
+    metainf = workdir.joinpath('META-INF')
+    metainf.mkdir(exist_ok=True)
+    xmlpath = metainf.joinpath('com.apple.ibooks.display-options.xml')
+    iBooksOptions.pltf = 'ipad'
+    iBooksOptions.fxlay = True
+    iBooksOptions.pubfont = True
+    iBooksOptions.opspread = False
+    iBooksOptions.interactive = None
+    iBooksOptions.orientation = 'landscape-only'
+    for platforms, options in [(3, 4), (50, 4), (500, 8)]:
+        string = optionsFileString(platforms, options)
+        def reset(i):
+            # start every call from the same file
+            with xmlpath.open('w') as xml:
+                xml.write(string)
+        results[str(platforms) + 'x' + str(options)] = timeCalls(lambda i: iBooksOptions.modifyMetaFile(xmlpath), iterations, reset)
+    return results
+
+# wall time of a fresh interpreter importing each tool, against a bare one
+def benchStartup(iterations):
+    results = {}
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, code in [('python', 'pass'), ('createSkeletonEpub', 'import createSkeletonEpub'), ('iBooksOptions', 'import iBooksOptions'), ('ePubSubParagraph', 'import ePubSubParagraph')]:
+        def call(i):
+            subprocess.run([sys.executable, '-c', code], cwd=here, check=True)
+        results[name] = timeCalls(call, iterations)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark createSkeletonEpub and iBooksOptions functions.')
+    parser.add_argument('-n',
+                    '--iterations',
+                    action='store',
+                    dest='iterations',
+                    type=int,
+                    default=200,
+                    help='Calls per benchmark')
+    parser.add_argument('-s',
+                    '--startup-iterations',
+                    action='store',
+                    dest='startup',
+                    type=int,
+                    default=10,
+                    help='Interpreter launches per startup benchmark')
+    parser.add_argument('-o',
+                    '--output',
+                    action='store',
+                    dest='output',
+                    default='benchmark.json',
+                    help='JSON file the results are written to')
+    args = parser.parse_args()
+    if args.iterations < 1 or args.startup < 1:
+        print ('Iterations must be at least 1. Exiting now.')
+        sys.exit(1)
+
+    results = {'timestamp': int(time.time()),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'iterations': args.iterations,
+               'unit': 'seconds'}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = pathlib.Path(tmpdir)
+        results['sanitizeTextString'] = benchSanitize(args.iterations)
+        results['createOPF'] = benchCreateOPF(args.iterations, workdir)
+        results['languageTags'] = benchLanguageTags(args.iterations)
+        results['modifyMetaFile'] = benchModifyMetaFile(args.iterations, workdir)
+    results['startup'] = benchStartup(args.startup)
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print ('Benchmark results written to ' + args.output)
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ from language_tags import tags
 import secrets
 from xml.dom import minidom
 import argparse
+import sourceDate
 
 # defaults safe to override when installing
 xmllang = 'en-US'      # Must be valid BCP 47
@@ -23,6 +24,7 @@ description = 'Book Description'
 contentdir = 'EPUB'
 opffile = 'content.opf'
 pubdate = ''           # When set to empty string, it uses six weeks in future
+identifier = ''        # When set to empty string, a random UUID is generated
 
 # parameter related functions
 def sanitizeTextString(stype, string):
@@ -106,6 +108,14 @@ def setPublicationDate(string):
     global pubdate
     pubdate = parsed.strftime("%Y-%m-%d")
 
+def setBookIdentifier(string):
+    string = sanitizeTextString('identifier', string)
+    if len(string) == 0:
+        print ('The book identifier can not be empty. Exiting.')
+        sys.exit(1)
+    global identifier
+    identifier = string
+
 def setXmlLang(string):
     if not tags.check(string):
         print ('The specified XML language tag is not a BCP 47 language tag. Exiting.')
@@ -185,12 +195,19 @@ def setContentDirectory(string):
     contentdir = string
 
 # non parameter related functions
+# honors SOURCE_DATE_EPOCH so identical input gives identical output
+def getNow():
+    now = sourceDate.sourceDateEpoch()
+    if now is None:
+        return pytz.utc.localize(datetime.datetime.utcnow())
+    return now
+
 def generatePubDate():
-    pdate = pytz.utc.localize(datetime.datetime.utcnow() + datetime.timedelta(weeks=6))
+    pdate = getNow() + datetime.timedelta(weeks=6)
     return pdate.strftime("%Y-%m-%d")
 
 def getTime():
-    now = pytz.utc.localize(datetime.datetime.utcnow())
+    now = getNow()
     return now.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 def prngUUID():
@@ -272,19 +289,27 @@ def createOPF(xml):
     node.setAttribute('scheme', 'marc:relators')
     node.appendChild(text)
     metadata.appendChild(node)
-    # add uuid
-    root.setAttribute('unique-identifier','prng-uuid')
-    uuid = mydom.createTextNode(prngUUID())
-    node = mydom.createElement('dc:identifier')
-    node.appendChild(uuid)
-    node.setAttribute('id','prng-uuid')
-    metadata.appendChild(node)
-    text = mydom.createTextNode('uuid')
-    node = mydom.createElement('meta')
-    node.appendChild(text)
-    node.setAttribute('property', 'marc:scheme')
-    node.setAttribute('refines', '#prng-uuid')
-    metadata.appendChild(node)
+    # add uuid, or the supplied identifier
+    if len(identifier) == 0:
+        root.setAttribute('unique-identifier','prng-uuid')
+        uuid = mydom.createTextNode(prngUUID())
+        node = mydom.createElement('dc:identifier')
+        node.appendChild(uuid)
+        node.setAttribute('id','prng-uuid')
+        metadata.appendChild(node)
+        text = mydom.createTextNode('uuid')
+        node = mydom.createElement('meta')
+        node.appendChild(text)
+        node.setAttribute('property', 'marc:scheme')
+        node.setAttribute('refines', '#prng-uuid')
+        metadata.appendChild(node)
+    else:
+        root.setAttribute('unique-identifier','pub-id')
+        text = mydom.createTextNode(identifier)
+        node = mydom.createElement('dc:identifier')
+        node.appendChild(text)
+        node.setAttribute('id','pub-id')
+        metadata.appendChild(node)
     # add timestamp
     text = mydom.createTextNode(getTime())
     node = mydom.createElement('meta');
@@ -362,6 +387,11 @@ def main():
                     dest='publicationdate',
                     default=pubdate,
                     help='Publication date')
+    parser.add_argument('-u',
+                    '--identifier',
+                    dest='identifier',
+                    default=identifier,
+                    help='Unique identifier for the book. A random UUID is used when not set')
     parser.add_argument('-x',
                     '--xmllang',
                     dest='xmllang',
@@ -395,6 +425,9 @@ def main():
     string = args.publicationdate.strip()
     if len(string) > 0:
         setPublicationDate(string)
+    string = args.identifier.strip()
+    if len(string) > 0:
+        setBookIdentifier(string)
     setXmlLang(args.xmllang.strip())
     setBookLang(args.booklang.strip())
     setContentDirectory(args.oebps.strip())
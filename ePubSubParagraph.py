@@ -3,8 +3,16 @@ import sys
 import os
 import re
 import tempfile
-from zipfile import ZipFile
+import time
+import json
+import sqlite3
+import argparse
+import zlib
+from zipfile import ZipFile, ZipInfo, BadZipFile
 from xml.dom import minidom
+from xml.parsers import expat
+import assetStore
+import sourceDate
 
 # Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
 #
@@ -16,6 +24,26 @@ from xml.dom import minidom
 # boolean so no archive is created if no subparagraphs are implemented
 modifiedFiles = False
 
+# boolean so shared assets are spliced in from the assetStore payloads
+useStore = False
+
+# registered transforms. Node transforms are run against matching elements
+#  during a single walk of each parsed document, string transforms are run
+#  against the serialized document when any node transform changed the DOM.
+nodeTransforms = []
+stringTransforms = []
+
+# function is called as function(mydom, node) for every element named tagname
+#  and returns False if nothing changed, True if the node was changed in place,
+#  or a list of the new elements when the node was replaced. Transforms
+#  registered later are then run on those new elements instead.
+def registerNodeTransform(name, tagname, function):
+    nodeTransforms.append({'name': name, 'tag': tagname, 'function': function, 'hits': 0, 'time': 0.0})
+
+# function is called as function(string) and must return the string.
+def registerStringTransform(name, function):
+    stringTransforms.append({'name': name, 'function': function, 'hits': 0, 'time': 0.0})
+
 # The fact that this is necessary indicates that minidom is not the right tool for this.
 # That or I am not using minidom correctly
 def specialCases(string):
@@ -27,6 +55,7 @@ def specialCases(string):
 
 def showUsage():
     print ("Usage: " + sys.argv[0] + " path/to/input.epub " + " path/to/output.epub")
+    print ("       " + sys.argv[0] + " --inventory path/to/index.json path/to/input.epub ...")
     sys.exit(1)
 
 # deep clones a node and adds clone as child to div
@@ -46,7 +75,91 @@ def cloneToParagraph(mydom, node, div, pstyle, pclass):
         par.appendChild(clone)
     div.appendChild(par)
 
-# parses an XHTML file and if subparagraphs found, modifies the file.
+# splits a paragraph with more than one flagged subparagraph into a div
+#  of paragraphs. Returns the new div and paragraphs if it was replaced.
+def splitSubParagraphs(mydom, node):
+    counter = 0
+    newdiv = mydom.createElement('div')
+    divid = ''
+    pstyle = ''
+    pclass = ''
+    if node.hasAttribute('id'):
+        divid = node.getAttribute('id')
+    if node.hasAttribute('style'):
+        pstyle = node.getAttribute('style')
+    if node.hasAttribute('class'):
+        pclass = node.getAttribute('class')
+    for child in node.childNodes:
+        subpar = False
+        if child.nodeType == 1 and child.tagName == "span":
+            # change this to epub:type if/when official
+            if child.hasAttribute('data-epubtype') and child.getAttribute('data-epubtype') == 'subparagraph':
+                subpar = True
+                counter += 1
+        if subpar:
+            cloneToParagraph(mydom, child, newdiv, pstyle, pclass)
+        else:
+            cloneDomNode(child, newdiv)
+    # only act if counted more than one subparagraph
+    if counter > 1:
+        node.parentNode.replaceChild(newdiv, node)
+        if len(divid) > 0:
+            newdiv.setAttribute('id', divid)
+        return [newdiv] + [child for child in newdiv.childNodes if child.nodeType == 1 and child.tagName == 'p']
+    return False
+
+# collects every element node below node in document order
+def collectElements(node, elements):
+    for child in node.childNodes:
+        if child.nodeType == 1:
+            elements.append(child)
+            collectElements(child, elements)
+
+# runs transforms on elements in reverse document order, so descendants are
+#  handled before an ancestor is replaced. When a transform replaces a node
+#  the transforms after it run on the new elements. Returns True if the DOM
+#  changed.
+def walkNodeTransforms(mydom, elements, transforms):
+    domchanged = False
+    for node in reversed(elements):
+        for index, transform in enumerate(transforms):
+            if node.tagName != transform['tag']:
+                continue
+            start = time.perf_counter()
+            result = transform['function'](mydom, node)
+            transform['time'] += time.perf_counter() - start
+            if not result:
+                continue
+            transform['hits'] += 1
+            domchanged = True
+            if result is not True:
+                walkNodeTransforms(mydom, result, transforms[index + 1:])
+                break
+    return domchanged
+
+# applies the registered node transforms in one walk of the DOM
+def applyNodeTransforms(mydom):
+    elements = []
+    collectElements(mydom, elements)
+    return walkNodeTransforms(mydom, elements, nodeTransforms)
+
+# applies the registered string transforms to a serialized document
+def applyStringTransforms(string):
+    for transform in stringTransforms:
+        start = time.perf_counter()
+        result = transform['function'](string)
+        transform['time'] += time.perf_counter() - start
+        if result != string:
+            transform['hits'] += 1
+        string = result
+    return string
+
+# prints hit counters and timings for every registered transform
+def showTransformStats():
+    for transform in nodeTransforms + stringTransforms:
+        print ("Transform " + transform['name'] + ": " + str(transform['hits']) + " hits in " + "{:.3f}".format(transform['time']) + " seconds.")
+
+# parses an XHTML file and if any registered transform changes it, modifies the file.
 def adjustParagraphNodes(xhtmlfile):
     global modifiedFiles
     try:
@@ -54,49 +167,13 @@ def adjustParagraphNodes(xhtmlfile):
     except:
         print ("Could not parse " + xhtmlfile + " as XML. Skipping.")
         return()
-    domchanged = False
-    # get list of all paragraph nodes
-    nodelist = mydom.getElementsByTagName('p')
-    # walk nodelist backwards as it will be changing
-    i = len(nodelist) - 1
-    while i >= 0 :
-        counter = 0
-        node = nodelist[i]
-        newdiv = mydom.createElement('div')
-        divid = ''
-        pstyle = ''
-        pclass = ''
-        if node.hasAttribute('id'):
-            divid = node.getAttribute('id')
-        if node.hasAttribute('style'):
-            pstyle = node.getAttribute('style')
-        if node.hasAttribute('class'):
-            pclass = node.getAttribute('class')
-        for child in node.childNodes:
-            subpar = False
-            if child.nodeType == 1 and child.tagName == "span":
-                # change this to epub:type if/when official
-                if child.hasAttribute('data-epubtype') and child.getAttribute('data-epubtype') == 'subparagraph':
-                    subpar = True
-                    counter += 1
-            if subpar:
-                cloneToParagraph(mydom, child, newdiv, pstyle, pclass)
-            else:
-                cloneDomNode(child, newdiv)
-        # only act if counted more than one subparagraph
-        if counter > 1:
-            node.parentNode.replaceChild(newdiv, node)
-            domchanged = True
-            if len(divid) > 0:
-                newdiv.setAttribute('id', divid)
-        # reduce iterator by 1
-        i -= 1
+    domchanged = applyNodeTransforms(mydom)
     if domchanged:
         #overwrite original file
         string = mydom.toprettyxml(indent="  ",newl="\n",encoding="UTF-8").decode()
         string = '\n'.join([x for x in string.split("\n") if x.strip()!=''])
         # special cases
-        string = specialCases(string)
+        string = applyStringTransforms(string)
         try:
             f = open(xhtmlfile, 'w')
         except:
@@ -107,12 +184,47 @@ def adjustParagraphNodes(xhtmlfile):
         modifiedFiles = True
         print ("File " + xhtmlfile + " has been modified.")
 
-# create new zip archive with files in same order as original
-def createModifiedEpub(unzipdir, outputfile, namelist):
+# zip timestamp from SOURCE_DATE_EPOCH, or None when it is not set
+def sourceDateTime():
+    stamp = sourceDate.sourceDateEpoch()
+    if stamp is None:
+        return None
+    # zip can only store timestamps from 1980 through 2107
+    if stamp.year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    if stamp.year > 2107:
+        return (2107, 12, 31, 23, 59, 58)
+    return stamp.timetuple()[0:6]
+
+# create new zip archive with files in same order as original. Member
+#  timestamps, attributes and compression are taken from the original
+#  archive, not the temp files, so identical input gives identical output.
+#  When SOURCE_DATE_EPOCH is set every member gets that timestamp instead.
+def createModifiedEpub(unzipdir, outputfile, infolist):
+    stamp = sourceDateTime()
     with ZipFile(outputfile, 'w') as newEpub:
-        for elem in namelist:
-            filename = os.path.join(unzipdir, elem)
-            newEpub.write(filename,elem)
+        for original in infolist:
+            if stamp is None:
+                info = ZipInfo(original.filename, original.date_time)
+            else:
+                info = ZipInfo(original.filename, stamp)
+            info.compress_type = original.compress_type
+            info.external_attr = original.external_attr
+            info.create_system = original.create_system
+            if original.is_dir():
+                newEpub.writestr(info, b'')
+                continue
+            filename = os.path.join(unzipdir, original.filename)
+            with open(filename, 'rb') as fh:
+                data = fh.read()
+            if useStore:
+                assetStore.writeMember(newEpub, info, data)
+            else:
+                newEpub.writestr(info, data)
+    if useStore:
+        removed = assetStore.collectGarbage()
+        if removed > 0:
+            print ("Removed " + str(removed) + " payloads from the asset store.")
 
 # The proper way would probably be to read the OPF file and extract all
 #  the files with a application/xml+xhtml mime type but those files
@@ -120,23 +232,162 @@ def createModifiedEpub(unzipdir, outputfile, namelist):
 def adjustEpub(inputfile, outputfile):
     with tempfile.TemporaryDirectory() as unzipdir:
         with ZipFile(inputfile, 'r') as myzip:
-            namelist = myzip.namelist()
+            infolist = myzip.infolist()
             myzip.extractall(unzipdir)
             for path,dirs,files in os.walk(unzipdir):
                 for filename in files:
                     if filename.endswith(".xhtml"):
                         adjustParagraphNodes(os.path.join(path,filename))
         if modifiedFiles:
-            createModifiedEpub(unzipdir, outputfile, namelist)
+            createModifiedEpub(unzipdir, outputfile, infolist)
             print("Modified ePub " + outputfile + " has been created.")
             print("Please validate with ePubCheck.")
         else:
             print("Subparagraph notation not found. Exiting.")
+        showTransformStats()
+
+# streams an XHTML member through expat and returns the subparagraph index
+#  for it. Offsets are byte offsets of the paragraph start tag within the
+#  uncompressed member.
+def scanChapter(stream):
+    chapter = {'paragraphs': 0, 'subparagraphs': 0, 'split': []}
+    stack = []
+    parser = expat.ParserCreate()
+    def startElement(name, attrs):
+        if name == 'p':
+            chapter['paragraphs'] += 1
+            stack.append({'id': attrs.get('id', ''), 'offset': parser.CurrentByteIndex, 'subparagraphs': 0})
+        elif name == 'span' and len(stack) > 0 and stack[-1] is not None:
+            # change this to epub:type if/when official
+            if attrs.get('data-epubtype') == 'subparagraph':
+                stack[-1]['subparagraphs'] += 1
+                chapter['subparagraphs'] += 1
+            stack.append(None)
+        else:
+            stack.append(None)
+    def endElement(name):
+        par = stack.pop()
+        # same rule as splitSubParagraphs, only more than one is split
+        if par is not None and par['subparagraphs'] > 1:
+            chapter['split'].append(par)
+    parser.StartElementHandler = startElement
+    parser.EndElementHandler = endElement
+    parser.ParseFile(stream)
+    # report in document order
+    chapter['split'].sort(key=lambda par: par['offset'])
+    return chapter
+
+# read-only scan of an ePub, nothing is extracted or written
+def scanEpub(inputfile):
+    # absolute so a rescan from another directory replaces the same book
+    book = {'file': os.path.abspath(inputfile), 'chapters': []}
+    seen = set()
+    with ZipFile(inputfile, 'r') as myzip:
+        for info in myzip.infolist():
+            elem = info.filename
+            if not elem.endswith(".xhtml"):
+                continue
+            # zip allows duplicate names, only the first one is indexed
+            if elem in seen:
+                print ("Duplicate member " + elem + " in " + inputfile + ". Skipping.")
+                continue
+            seen.add(elem)
+            try:
+                with myzip.open(info) as stream:
+                    chapter = scanChapter(stream)
+            except expat.ExpatError:
+                print ("Could not parse " + elem + " in " + inputfile + " as XML. Skipping.")
+                continue
+            except (zlib.error, BadZipFile, EOFError, NotImplementedError, RuntimeError):
+                # corrupt deflate stream, bad CRC, unsupported compression or encrypted member
+                print ("Could not read " + elem + " in " + inputfile + ". Skipping.")
+                continue
+            if chapter['subparagraphs'] > 0:
+                book['chapters'].append(dict(member=elem, **chapter))
+    return book
+
+def writeInventoryJSON(books, outputfile):
+    with open(outputfile, 'w') as fh:
+        json.dump({'books': books}, fh, separators=(',', ':'))
+
+def writeInventorySQLite(books, outputfile):
+    conn = sqlite3.connect(outputfile)
+    with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS chapters (book TEXT, member TEXT, paragraphs INTEGER, subparagraphs INTEGER, split INTEGER, PRIMARY KEY (book, member))')
+        conn.execute('CREATE TABLE IF NOT EXISTS paragraphs (book TEXT, member TEXT, id TEXT, offset INTEGER, subparagraphs INTEGER)')
+        for book in books:
+            # a rescan replaces the previous index for the book
+            conn.execute('DELETE FROM chapters WHERE book = ?', (book['file'],))
+            conn.execute('DELETE FROM paragraphs WHERE book = ?', (book['file'],))
+            for chapter in book['chapters']:
+                conn.execute('INSERT INTO chapters VALUES (?, ?, ?, ?, ?)', (book['file'], chapter['member'], chapter['paragraphs'], chapter['subparagraphs'], len(chapter['split'])))
+                conn.executemany('INSERT INTO paragraphs VALUES (?, ?, ?, ?, ?)', [(book['file'], chapter['member'], par['id'], par['offset'], par['subparagraphs']) for par in chapter['split']])
+    conn.close()
+
+# dry run index of subparagraph usage. Output format is picked by the
+#  extension of outputfile, .sqlite or .db for SQLite and JSON otherwise.
+def inventoryEpubs(inputfiles, outputfile):
+    books = []
+    for inputfile in inputfiles:
+        try:
+            book = scanEpub(inputfile)
+        except (OSError, BadZipFile):
+            print ("Could not read " + inputfile + " as a zip archive. Skipping.")
+            continue
+        if len(book['chapters']) > 0:
+            books.append(book)
+    extension = os.path.splitext(outputfile)[1].lower()
+    if extension in ['.sqlite', '.db']:
+        writeInventorySQLite(books, outputfile)
+    else:
+        writeInventoryJSON(books, outputfile)
+    print ("Subparagraph notation found in " + str(len(books)) + " of " + str(len(inputfiles)) + " ePubs.")
+    print ("Inventory " + outputfile + " has been created.")
+
+registerNodeTransform('subparagraph', 'p', splitSubParagraphs)
+registerStringTransform('specialCases', specialCases)
 
 def main():
-    if len(sys.argv) != 3:
+    parser = argparse.ArgumentParser(description='Split paragraphs flagged with subparagraph spans, or index them without writing an ePub.')
+    parser.add_argument('-i',
+                    '--inventory',
+                    action='store',
+                    dest='inventory',
+                    default='',
+                    help='Write a JSON (or .sqlite/.db) index of subparagraph usage for every input ePub instead')
+    parser.add_argument('-S',
+                    '--store',
+                    action='store',
+                    dest='store',
+                    default='',
+                    help='Reuse compressed fonts, images and CSS from this asset store directory')
+    parser.add_argument('-L',
+                    '--store-limit',
+                    action='store',
+                    dest='storelimit',
+                    type=int,
+                    default=assetStore.storelimit // 1048576,
+                    help='Size in MiB the asset store is trimmed to after packaging')
+    parser.add_argument('files',
+                    nargs='+',
+                    help='path/to/input.epub path/to/output.epub, or input ePubs with --inventory')
+    args = parser.parse_args()
+    inventory = args.inventory.strip()
+    if len(inventory) > 0:
+        inventoryEpubs(args.files, inventory)
+        return
+    if len(args.files) != 2:
         showUsage()
-    adjustEpub(sys.argv[1], sys.argv[2])
+    store = args.store.strip()
+    if len(store) > 0:
+        if args.storelimit < 0:
+            print ("The asset store limit can not be negative. Exiting.")
+            sys.exit(1)
+        global useStore
+        useStore = True
+        assetStore.setStoreDirectory(store)
+        assetStore.setStoreLimit(args.storelimit * 1048576)
+    adjustEpub(args.files[0], args.files[1])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
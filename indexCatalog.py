@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+import sys
+import os
+import zlib
+import hashlib
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile, BadZipFile
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+
+# Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
+#
+# Creative Commons CC0 “No Rights Reserved”
+#  See https://creativecommons.org/share-your-work/public-domain/cc0/
+#
+# Indexes the package document metadata of many ePubs into SQLite. Only
+#  container.xml and the package document are read from each archive, and
+#  books whose size, mtime or hash have not changed are not parsed again.
+#  Books that can not be read keep a row with NULL hash and metadata, so they
+#  are not read again until they change. Rows for books that no longer exist
+#  under the scanned paths are removed.
+
+# rows are committed every batchsize books so a failure keeps earlier work
+batchsize = 100
+
+containerns = 'urn:oasis:names:tc:opendocument:xmlns:container'
+opfns = 'http://www.idpf.org/2007/opf'
+dcns = 'http://purl.org/dc/elements/1.1/'
+
+def createTables(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS books (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT, title TEXT, creator TEXT, language TEXT, date TEXT, identifier TEXT, modified TEXT)')
+
+def fileHash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1048576), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def nodeText(node):
+    return ''.join(child.data for child in node.childNodes if child.nodeType in [3, 4]).strip()
+
+def dcText(metadata, name):
+    nodelist = metadata.getElementsByTagNameNS(dcns, name)
+    if len(nodelist) == 0:
+        return ''
+    return nodeText(nodelist[0])
+
+# reads the metadata createOPF writes from the package document of an ePub
+def readMetadata(path):
+    with ZipFile(path, 'r') as myzip:
+        container = minidom.parseString(myzip.read('META-INF/container.xml'))
+        rootfile = container.getElementsByTagNameNS(containerns, 'rootfile')[0]
+        opf = minidom.parseString(myzip.read(rootfile.getAttribute('full-path')))
+    root = opf.getElementsByTagNameNS(opfns, 'package')[0]
+    metadata = opf.getElementsByTagNameNS(opfns, 'metadata')[0]
+    record = {}
+    record['title'] = dcText(metadata, 'title')
+    record['creator'] = '; '.join(nodeText(node) for node in metadata.getElementsByTagNameNS(dcns, 'creator'))
+    record['language'] = dcText(metadata, 'language')
+    record['date'] = dcText(metadata, 'date')
+    # the identifier the package unique-identifier points at, else the first
+    record['identifier'] = dcText(metadata, 'identifier')
+    uid = root.getAttribute('unique-identifier')
+    for node in metadata.getElementsByTagNameNS(dcns, 'identifier'):
+        if len(uid) > 0 and node.getAttribute('id') == uid:
+            record['identifier'] = nodeText(node)
+    record['modified'] = ''
+    for node in metadata.getElementsByTagNameNS(opfns, 'meta'):
+        if node.getAttribute('property') == 'dcterms:modified':
+            record['modified'] = nodeText(node)
+    return record
+
+# worker. Returns the hash and the metadata, or None for the metadata when
+#  the hash matches oldhash and the book does not need to be parsed again.
+def scanBook(path, oldhash):
+    try:
+        newhash = fileHash(path)
+        if newhash == oldhash:
+            return (newhash, None)
+        return (newhash, readMetadata(path))
+    except (OSError, KeyError, IndexError, BadZipFile, ExpatError, EOFError, zlib.error, NotImplementedError, RuntimeError, UnicodeDecodeError):
+        # includes corrupt deflate streams, unsupported compression and encrypted members
+        print ('Could not read package metadata from ' + path + '. Skipping.')
+        return (None, None)
+
+def findEpubs(paths):
+    epubs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.endswith('.epub'):
+                        epubs.append(os.path.join(dirpath, filename))
+        else:
+            epubs.append(path)
+    return epubs
+
+# deletes the rows of books under the scanned paths that were not found.
+#  A scanned path covers itself and, as a directory, everything below it.
+def pruneBooks(conn, paths, known, found):
+    roots = [os.path.abspath(path) for path in paths]
+    removed = 0
+    for path in known:
+        if path in found:
+            continue
+        if any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots):
+            conn.execute('DELETE FROM books WHERE path = ?', (path,))
+            removed += 1
+    return removed
+
+def indexCatalog(paths, database, jobs):
+    conn = sqlite3.connect(database)
+    createTables(conn)
+    known = {}
+    for row in conn.execute('SELECT path, size, mtime, hash FROM books'):
+        known[row[0]] = row[1:]
+    pending = []
+    skipped = 0
+    found = set()
+    for path in findEpubs(paths):
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            print ('Could not find ' + path + '. Skipping.')
+            continue
+        found.add(path)
+        old = known.get(path)
+        if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+            skipped += 1
+            continue
+        oldhash = None if old is None else old[2]
+        pending.append((path, stat.st_size, stat.st_mtime_ns, oldhash))
+    removed = pruneBooks(conn, paths, known, found)
+    updated = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(scanBook, entry[0], entry[3]) for entry in pending]
+        for count, (entry, future) in enumerate(zip(pending, futures), 1):
+            if count % batchsize == 0:
+                conn.commit()
+            path, size, mtime, oldhash = entry
+            try:
+                newhash, record = future.result()
+            except Exception as error:
+                print ('Could not index ' + path + ' (' + repr(error) + '). Skipping.')
+                newhash = None
+            if newhash is None:
+                # flag as unreadable, old metadata no longer describes the book
+                conn.execute('INSERT INTO books (path, size, mtime) VALUES (?, ?, ?) '
+                             'ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, hash = NULL, '
+                             'title = NULL, creator = NULL, language = NULL, date = NULL, identifier = NULL, modified = NULL',
+                             (path, size, mtime))
+                failed += 1
+                continue
+            if record is None:
+                # touched but unchanged, only remember the new size and mtime
+                conn.execute('UPDATE books SET size = ?, mtime = ? WHERE path = ?', (size, mtime, path))
+                skipped += 1
+                continue
+            conn.execute('INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                         'ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, hash = excluded.hash, '
+                         'title = excluded.title, creator = excluded.creator, language = excluded.language, '
+                         'date = excluded.date, identifier = excluded.identifier, modified = excluded.modified',
+                         (path, size, mtime, newhash, record['title'], record['creator'], record['language'],
+                          record['date'], record['identifier'], record['modified']))
+            updated += 1
+    conn.commit()
+    conn.close()
+    print (str(updated) + ' ePubs indexed, ' + str(skipped) + ' unchanged, ' + str(failed) + ' unreadable, ' + str(removed) + ' removed.')
+
+def main():
+    parser = argparse.ArgumentParser(description='Index the package document metadata of ePubs into a SQLite database.')
+    parser.add_argument('-d',
+                    '--database',
+                    action='store',
+                    dest='database',
+                    default='catalog.sqlite',
+                    help='SQLite database to create or update')
+    parser.add_argument('-j',
+                    '--jobs',
+                    action='store',
+                    dest='jobs',
+                    type=int,
+                    default=os.cpu_count(),
+                    help='Number of ePubs scanned in parallel')
+    parser.add_argument('paths',
+                    nargs='+',
+                    help='ePub files, or directories searched for .epub files')
+    args = parser.parse_args()
+    if args.jobs < 1:
+        print ('The number of jobs must be at least 1. Exiting now.')
+        sys.exit(1)
+    indexCatalog(args.paths, args.database.strip(), args.jobs)
+
+if __name__ == "__main__":
+    main()
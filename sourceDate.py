@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import sys
+import os
+import datetime
+
+# Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
+#
+# Creative Commons CC0 “No Rights Reserved”
+#  See https://creativecommons.org/share-your-work/public-domain/cc0/
+#
+# SOURCE_DATE_EPOCH handling shared by the tools, see
+#  https://reproducible-builds.org/specs/source-date-epoch/
+
+# returns SOURCE_DATE_EPOCH as a UTC datetime, or None when it is not set
+def sourceDateEpoch():
+    epoch = os.environ.get('SOURCE_DATE_EPOCH', '').strip()
+    if len(epoch) == 0:
+        return None
+    try:
+        return datetime.datetime.fromtimestamp(int(epoch), datetime.timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        print ('SOURCE_DATE_EPOCH must be a number of seconds since the epoch. Exiting.')
+        sys.exit(1)
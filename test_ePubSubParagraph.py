@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import warnings
+from zipfile import ZipFile
+from xml.dom import minidom
+import ePubSubParagraph
+
+# Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
+#
+# Creative Commons CC0 “No Rights Reserved”
+#  See https://creativecommons.org/share-your-work/public-domain/cc0/
+#
+# Transform registry checks. Run with pytest.
+
+chapter = '''<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>x</title></head><body>
+<p id="a"><span data-epubtype="subparagraph">One</span><span data-epubtype="subparagraph">Two</span></p>
+<p>Three</p>
+</body></html>'''
+
+def markParagraph(mydom, node):
+    node.setAttribute('data-seen', 'yes')
+    return True
+
+def test_laterTransformSeesSplitParagraphs(monkeypatch):
+    monkeypatch.setattr(ePubSubParagraph, 'nodeTransforms', [])
+    ePubSubParagraph.registerNodeTransform('subparagraph', 'p', ePubSubParagraph.splitSubParagraphs)
+    ePubSubParagraph.registerNodeTransform('mark', 'p', markParagraph)
+    mydom = minidom.parseString(chapter)
+    assert ePubSubParagraph.applyNodeTransforms(mydom)
+    paragraphs = mydom.getElementsByTagName('p')
+    assert [node.getAttribute('data-seen') for node in paragraphs] == ['yes', 'yes', 'yes']
+    assert mydom.getElementsByTagName('div')[0].getAttribute('id') == 'a'
+    subparagraph, mark = ePubSubParagraph.nodeTransforms
+    assert subparagraph['hits'] == 1
+    # the two split paragraphs and the plain one, not the replaced original
+    assert mark['hits'] == 3
+
+def test_inventoryDuplicateMembers(tmp_path, monkeypatch):
+    inputfile = tmp_path.joinpath('dup.epub')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with ZipFile(inputfile, 'w') as myzip:
+            myzip.writestr('a.xhtml', chapter)
+            myzip.writestr('a.xhtml', chapter)
+    database = str(tmp_path.joinpath('inventory.sqlite'))
+    ePubSubParagraph.inventoryEpubs([str(inputfile)], database)
+    # a rescan through a relative path replaces the rows of the same book
+    monkeypatch.chdir(tmp_path)
+    ePubSubParagraph.inventoryEpubs(['dup.epub'], database)
+    conn = sqlite3.connect(database)
+    assert conn.execute('SELECT book, member FROM chapters').fetchall() == [(os.path.abspath('dup.epub'), 'a.xhtml')]
+    assert conn.execute('SELECT COUNT(*) FROM paragraphs').fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+from zipfile import ZipFile
+import indexCatalog
+
+# Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
+#
+# Creative Commons CC0 “No Rights Reserved”
+#  See https://creativecommons.org/share-your-work/public-domain/cc0/
+#
+# Catalog indexer checks. Run with pytest.
+
+container = '''<?xml version="1.0" encoding="UTF-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile full-path="EPUB/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>'''
+
+opf = '''<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="pub-id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>{title}</dc:title>
+    <dc:language>en-US</dc:language>
+    <dc:creator>Book Author</dc:creator>
+    <dc:identifier id="pub-id">{title}-id</dc:identifier>
+    <meta property="dcterms:modified">2023-11-14T22:13:20Z</meta>
+  </metadata>
+</package>'''
+
+def createEpub(path, title):
+    with ZipFile(path, 'w') as myzip:
+        myzip.writestr('mimetype', 'application/epub+zip')
+        myzip.writestr('META-INF/container.xml', container)
+        myzip.writestr('EPUB/content.opf', opf.format(title=title))
+
+def rows(database):
+    conn = sqlite3.connect(database)
+    result = {}
+    for row in conn.execute('SELECT path, mtime, hash, title, identifier FROM books'):
+        result[os.path.basename(row[0])] = row[1:]
+    conn.close()
+    return result
+
+def test_indexCatalog(tmp_path, capsys):
+    books = tmp_path.joinpath('books')
+    books.mkdir()
+    database = str(tmp_path.joinpath('catalog.sqlite'))
+    createEpub(books.joinpath('a.epub'), 'Alpha')
+    createEpub(books.joinpath('b.epub'), 'Beta')
+    indexCatalog.indexCatalog([str(books)], database, 1)
+    first = rows(database)
+    assert first['a.epub'][2:] == ('Alpha', 'Alpha-id')
+    assert first['b.epub'][2:] == ('Beta', 'Beta-id')
+    capsys.readouterr()
+
+    # touched only, hash refresh keeps the metadata and records the new mtime
+    stat = os.stat(books.joinpath('a.epub'))
+    os.utime(books.joinpath('a.epub'), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    # changed content is parsed again
+    createEpub(books.joinpath('b.epub'), 'Gamma')
+    indexCatalog.indexCatalog([str(books)], database, 1)
+    assert capsys.readouterr().out.strip() == '1 ePubs indexed, 1 unchanged, 0 unreadable, 0 removed.'
+    second = rows(database)
+    assert second['a.epub'][0] == first['a.epub'][0] + 10**9
+    assert second['a.epub'][1:] == first['a.epub'][1:]
+    assert second['b.epub'][2:] == ('Gamma', 'Gamma-id')
+    assert second['b.epub'][1] != first['b.epub'][1]
+
+    # nothing changed, nothing is read
+    indexCatalog.indexCatalog([str(books)], database, 1)
+    assert capsys.readouterr().out.strip() == '0 ePubs indexed, 2 unchanged, 0 unreadable, 0 removed.'
+
+    # a removed book loses its row, an unreadable one its metadata
+    os.unlink(books.joinpath('a.epub'))
+    books.joinpath('b.epub').write_bytes(b'not a zip archive')
+    indexCatalog.indexCatalog([str(books)], database, 1)
+    third = rows(database)
+    assert list(third) == ['b.epub']
+    assert third['b.epub'][1:] == (None, None, None)
+    capsys.readouterr()
+    indexCatalog.indexCatalog([str(books)], database, 1)
+    assert capsys.readouterr().out.strip() == '0 ePubs indexed, 1 unchanged, 0 unreadable, 0 removed.'
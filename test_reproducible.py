@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import os
+import random
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+import assetStore
+import ePubSubParagraph
+import createSkeletonEpub
+
+# Copyright 2020 Michael A. Peters but released to the equivalent of public domain:
+#
+# Creative Commons CC0 “No Rights Reserved”
+#  See https://creativecommons.org/share-your-work/public-domain/cc0/
+#
+# Identical input must give byte identical output. Run with pytest.
+
+chapter = '''<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>x</title></head><body>
+<p id="a"><span data-epubtype="subparagraph">One</span><span data-epubtype="subparagraph">Two</span></p>
+</body></html>'''
+
+def createInputEpub(path):
+    with ZipFile(path, 'w') as myzip:
+        myzip.writestr('mimetype', 'application/epub+zip')
+        myzip.writestr('META-INF/container.xml', '<container/>', compress_type=ZIP_DEFLATED)
+        myzip.writestr('EPUB/ch1.xhtml', chapter, compress_type=ZIP_DEFLATED)
+
+def repack(tmp_path, name):
+    inputfile = tmp_path.joinpath('in.epub')
+    unzipdir = tmp_path.joinpath('unzip')
+    with ZipFile(inputfile, 'r') as myzip:
+        infolist = myzip.infolist()
+        myzip.extractall(unzipdir)
+    for info in infolist:
+        # writestr() can not create members without attributes, as a zip
+        #  made on Windows has, so the test input marks them by name
+        if info.filename.endswith('-noattr.otf'):
+            info.external_attr = 0
+    outputfile = tmp_path.joinpath(name)
+    ePubSubParagraph.createModifiedEpub(str(unzipdir), outputfile, infolist)
+    return outputfile
+
+def test_createModifiedEpub(tmp_path, monkeypatch):
+    # without SOURCE_DATE_EPOCH timestamps come from the original archive
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    createInputEpub(tmp_path.joinpath('in.epub'))
+    first = repack(tmp_path, 'first.epub')
+    # temp file mtimes must not leak into the archive
+    os.utime(tmp_path.joinpath('unzip', 'EPUB', 'ch1.xhtml'), (0, 0))
+    second = repack(tmp_path, 'second.epub')
+    assert first.read_bytes() == second.read_bytes()
+    with ZipFile(tmp_path.joinpath('in.epub'), 'r') as original, ZipFile(first, 'r') as myzip:
+        assert myzip.namelist() == ['mimetype', 'META-INF/container.xml', 'EPUB/ch1.xhtml']
+        for info in original.infolist():
+            assert myzip.getinfo(info.filename).date_time == info.date_time
+
+def test_sourceDateEpoch(tmp_path, monkeypatch):
+    createInputEpub(tmp_path.joinpath('in.epub'))
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1700000000')
+    first = repack(tmp_path, 'first.epub')
+    second = repack(tmp_path, 'second.epub')
+    assert first.read_bytes() == second.read_bytes()
+    with ZipFile(first, 'r') as myzip:
+        assert myzip.getinfo('EPUB/ch1.xhtml').date_time == (2023, 11, 14, 22, 13, 20)
+    # zip timestamps end in 2107
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '4400000000')
+    with ZipFile(repack(tmp_path, 'late.epub'), 'r') as myzip:
+        assert myzip.getinfo('EPUB/ch1.xhtml').date_time == (2107, 12, 31, 23, 59, 58)
+
+def test_adjustEpub(tmp_path, monkeypatch):
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    inputfile = tmp_path.joinpath('in.epub')
+    createInputEpub(inputfile)
+    first = tmp_path.joinpath('first.epub')
+    second = tmp_path.joinpath('second.epub')
+    ePubSubParagraph.adjustEpub(str(inputfile), str(first))
+    ePubSubParagraph.adjustEpub(str(inputfile), str(second))
+    assert first.read_bytes() == second.read_bytes()
+    with ZipFile(first, 'r') as myzip:
+        assert b'<div id="a">' in myzip.read('EPUB/ch1.xhtml')
+
+def test_assetStore(tmp_path, monkeypatch):
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    rnd = random.Random(0)
+    font = bytes(rnd.getrandbits(8) for i in range(20000)) + b'glyph' * 4000
+    css = b'p { margin: 0; }\n' * 200
+    with ZipFile(tmp_path.joinpath('in.epub'), 'w') as myzip:
+        myzip.writestr('mimetype', 'application/epub+zip')
+        myzip.writestr('EPUB/ch1.xhtml', chapter, compress_type=ZIP_DEFLATED)
+        info = ZipInfo('EPUB/fonts/Schrift-ü-noattr.otf', (2020, 1, 1, 0, 0, 0))
+        info.compress_type = ZIP_DEFLATED
+        info.create_system = 0
+        myzip.writestr(info, font)
+        myzip.writestr('EPUB/style.css', css, compress_type=ZIP_DEFLATED)
+    monkeypatch.setattr(assetStore, 'storedir', str(tmp_path.joinpath('store')))
+    monkeypatch.setattr(ePubSubParagraph, 'useStore', False)
+    plain = repack(tmp_path, 'plain.epub').read_bytes()
+    monkeypatch.setattr(ePubSubParagraph, 'useStore', True)
+    cold = repack(tmp_path, 'cold.epub').read_bytes()
+    assert sum(len(files) for path, dirs, files in os.walk(assetStore.storedir)) == 2
+    warm = repack(tmp_path, 'warm.epub').read_bytes()
+    assert cold == plain
+    assert warm == plain
+    # a damaged payload is replaced, not copied into the archive
+    for path, dirs, files in os.walk(assetStore.storedir):
+        for filename in files:
+            with open(os.path.join(path, filename), 'r+b') as fh:
+                fh.truncate(100)
+    assert repack(tmp_path, 'repaired.epub').read_bytes() == plain
+    with ZipFile(tmp_path.joinpath('warm.epub'), 'r') as myzip:
+        assert myzip.read('EPUB/fonts/Schrift-ü-noattr.otf') == font
+        assert myzip.getinfo('EPUB/fonts/Schrift-ü-noattr.otf').external_attr == 0o600 << 16
+
+def test_createOPF(tmp_path, monkeypatch):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1700000000')
+    monkeypatch.setattr(createSkeletonEpub, 'identifier', '')
+    createSkeletonEpub.setBookIdentifier('urn:uuid:00000000-0000-4000-8000-000000000000')
+    first = tmp_path.joinpath('first.opf')
+    second = tmp_path.joinpath('second.opf')
+    createSkeletonEpub.createOPF(first)
+    createSkeletonEpub.createOPF(second)
+    assert first.read_bytes() == second.read_bytes()
+    assert b'2023-11-14T22:13:20Z' in first.read_bytes()